@@ -0,0 +1,155 @@
+"""
+離線用的 Gemini 替身 (壓力測試用)
+
+install() 會直接替換 google.generativeai 的 GenerativeModel 與 embed_content，
+main.py 與 chromadb 的 GoogleGenerativeAiEmbeddingFunction 都透過這兩個入口呼叫 Gemini，
+因此不需要修改主程式，也不會消耗任何 API 額度。
+"""
+import hashlib
+import math
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+
+EMBEDDING_DIM = 768  # 與 text-embedding-004 相同
+
+
+@dataclass
+class FakeGeminiConfig:
+    rewrite_latency_ms: float = 400.0
+    answer_latency_ms: float = 2500.0
+    embed_latency_ms: float = 120.0
+    latency_sigma: float = 0.35      # 對數常態分佈的離散程度
+    rate_limit_rate: float = 0.0     # 回傳 429 的機率
+    error_rate: float = 0.0          # 回傳 500 的機率
+    seed: int = 42
+
+
+class StageRecorder:
+    """收集各階段耗時 (毫秒)，多執行緒安全。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = {}
+
+    def record(self, stage: str, ms: float):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(ms)
+
+    def snapshot(self) -> Dict[str, List[float]]:
+        with self._lock:
+            return {stage: list(values) for stage, values in self.samples.items()}
+
+
+class _FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+def fake_embedding(text: str) -> List[float]:
+    """依文字內容產生固定的向量，同樣的字詞會得到相近的結果。"""
+    vec = [0.0] * EMBEDDING_DIM
+    for ch in text:
+        h = int(hashlib.md5(ch.encode("utf-8")).hexdigest(), 16)
+        vec[h % EMBEDDING_DIM] += 1.0 if (h >> 16) & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+class FakeGemini:
+    def __init__(self, config: FakeGeminiConfig, recorder: StageRecorder):
+        self.config = config
+        self.recorder = recorder
+        self._rng = random.Random(config.seed)
+        self._rng_lock = threading.Lock()
+
+    # --- 延遲與錯誤模擬 ---
+    def _simulate(self, stage: str, median_ms: float):
+        with self._rng_lock:
+            delay_ms = self._rng.lognormvariate(math.log(max(median_ms, 1.0)), self.config.latency_sigma)
+            roll = self._rng.random()
+        time.sleep(delay_ms / 1000)
+        self.recorder.record(stage, delay_ms)
+        if roll < self.config.rate_limit_rate:
+            self.recorder.record(f"{stage}_429", delay_ms)
+            raise google_exceptions.ResourceExhausted("429 Quota exceeded (fake)")
+        if roll < self.config.rate_limit_rate + self.config.error_rate:
+            self.recorder.record(f"{stage}_error", delay_ms)
+            raise google_exceptions.InternalServerError("500 Internal error (fake)")
+
+    # --- 回覆內容 ---
+    def _rewrite(self, prompt: str) -> str:
+        match = re.search(r"問題:(.*?) 只輸出字串", prompt, re.DOTALL)
+        question = match.group(1).strip() if match else prompt[-30:]
+        return f"{question} 法律責任 罰則"
+
+    def _answer(self, prompt: str) -> str:
+        # 從【參考資料】中挑出法條，模擬模型引用 <ref> 標籤
+        articles = re.findall(r"^\s*(\S+ 第 [\d\-]+ 條)：(.+)$", prompt, re.MULTILINE)[:3]
+        if not articles:
+            articles = [("民法 第 184 條", "因故意或過失，不法侵害他人之權利者，負損害賠償責任。")]
+        refs = "\n".join(
+            f'* <ref title="{title}" content="{content.strip().replace(chr(34), "")}" />'
+            for title, content in articles
+        )
+        return f"""結論：依照目前的情況，你可能需要負擔相關法律責任。
+
+**情境案例**
+小明在巷口騎車時擦撞路人，事後雙方協商賠償，最後以和解收場。
+
+**詳細分析**
+依據下列法條，行為人若有故意或過失，須依法負責。
+
+**實務建議**
+1. 保留現場照片與證據。
+2. 盡快報警並取得相關紀錄。
+3. 諮詢專業律師評估後續程序。
+
+**法律依據**
+{refs}
+
+---JSON_START---
+{{
+    "domain": "民事",
+    "risk_level": "中",
+    "keywords": ["損害賠償", "過失"]
+}}
+---JSON_END---"""
+
+    # --- 替換 google.generativeai 的入口 ---
+    def generate_content(self, prompt, **kwargs) -> _FakeResponse:
+        prompt = prompt if isinstance(prompt, str) else str(prompt)
+        if "改寫為精準法律搜尋字串" in prompt:
+            self._simulate("rewrite", self.config.rewrite_latency_ms)
+            return _FakeResponse(self._rewrite(prompt))
+        self._simulate("generate", self.config.answer_latency_ms)
+        return _FakeResponse(self._answer(prompt))
+
+    def embed_content(self, model=None, content=None, **kwargs):
+        self._simulate("embed", self.config.embed_latency_ms)
+        if isinstance(content, str):
+            return {"embedding": fake_embedding(content)}
+        return {"embedding": [fake_embedding(text) for text in content]}
+
+
+def install(config: FakeGeminiConfig, recorder: StageRecorder) -> FakeGemini:
+    """把 google.generativeai 換成替身，必須在 import main 之前呼叫。"""
+    fake = FakeGemini(config, recorder)
+
+    class FakeGenerativeModel:
+        def __init__(self, model_name: str = "", **kwargs):
+            self.model_name = model_name
+
+        def generate_content(self, prompt, **kwargs):
+            return fake.generate_content(prompt, **kwargs)
+
+    genai.configure = lambda *args, **kwargs: None
+    genai.GenerativeModel = FakeGenerativeModel
+    genai.embed_content = fake.embed_content
+    return fake
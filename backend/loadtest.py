@@ -0,0 +1,323 @@
+"""
+/chat 流程的離線壓力測試
+
+以 fake_gemini 取代 Gemini (改寫、生成、Embedding)，在本機啟動一個 uvicorn worker，
+依指定比例重播 /chat、/sessions、/sessions/{id} 流量，最後輸出吞吐量、延遲分位數、錯誤率與各階段耗時。
+
+使用方式：
+    python backend/loadtest.py --concurrency 8 --requests 300
+    python backend/loadtest.py --duration 60 --rate-limit-rate 0.05 --answer-latency-ms 1500
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+current_dir = Path(__file__).parent
+sys.path.insert(0, str(current_dir))
+
+import fake_gemini
+
+SAMPLE_QUESTIONS = [
+    "闖紅燈會罰多少錢？",
+    "拒絕酒測會有什麼後果？",
+    "騎車沒戴安全帽會被罰嗎？",
+    "車禍撞傷人要賠多少？",
+    "肇逃會被判多久？",
+    "朋友欠錢不還怎麼辦？",
+    "樓上噪音很吵可以告嗎？",
+    "在網路上罵人會犯法嗎？",
+    "合夥人捲款潛逃該怎麼處理？",
+    "被騙錢可以報警嗎？",
+    "超速被拍到要怎麼申訴？",
+    "無照駕駛被抓到會怎樣？",
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Legal AI 後端離線壓力測試")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時發送請求的虛擬使用者數")
+    parser.add_argument("--requests", type=int, default=200, help="總請求數")
+    parser.add_argument("--duration", type=float, default=None, help="最長執行秒數 (與 --requests 先到先停)")
+    parser.add_argument("--clients", type=int, default=20, help="模擬的 client_id 數量")
+    parser.add_argument("--mix", default="chat=0.5,sessions=0.3,session=0.2",
+                        help="流量比例：chat=/chat、sessions=/sessions、session=/sessions/{id}")
+    parser.add_argument("--rewrite-latency-ms", type=float, default=400.0)
+    parser.add_argument("--answer-latency-ms", type=float, default=2500.0)
+    parser.add_argument("--embed-latency-ms", type=float, default=120.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.35, help="延遲對數常態分佈的 sigma")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Gemini 回傳 429 的機率")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Gemini 回傳 500 的機率")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", dest="json_output", default=None, help="另存 JSON 報告的路徑")
+    parser.add_argument("--verbose", action="store_true", help="顯示後端的 log 輸出")
+    return parser.parse_args()
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, value = part.split("=")
+        weights[name.strip()] = float(value)
+    unknown = set(weights) - {"chat", "sessions", "session"}
+    if unknown:
+        raise ValueError(f"❌ 未知的流量類型: {', '.join(sorted(unknown))}")
+    return weights
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def load_backend(recorder: fake_gemini.StageRecorder):
+    """在替身 Gemini 與暫存資料庫下載入 main，並建立離線的向量索引。"""
+    import chromadb
+    import main
+
+    # 正式的 chroma_db 需要真正的 Gemini embedding，這裡改用替身向量建立記憶體索引
+    client = chromadb.EphemeralClient()
+    collection = client.get_or_create_collection(name="legal_knowledge_loadtest", embedding_function=main.google_ef)
+    if collection.count() == 0 and main.all_laws:
+        collection.add(
+            ids=[law["id"] for law in main.all_laws],
+            documents=[law["text"] for law in main.all_laws],
+            embeddings=[fake_gemini.fake_embedding(law["text"]) for law in main.all_laws],
+        )
+    main.collection = collection
+
+    # 計時包裝：main 內部以全域名稱呼叫，替換後即可統計
+    def timed(stage, fn):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                recorder.record(stage, (time.perf_counter() - start) * 1000)
+        return wrapper
+
+    main.retrieve_candidates = timed("retrieval", main.retrieve_candidates)
+    main.query_gemini_rag = timed("rag_total", main.query_gemini_rag)
+    return main
+
+
+def start_server(app, port: int):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("❌ uvicorn 啟動失敗")
+        time.sleep(0.05)
+    return server, thread
+
+
+class TrafficDriver:
+    def __init__(self, base_url: str, args, weights: Dict[str, float]):
+        self.base_url = base_url
+        self.args = args
+        self.kinds = list(weights)
+        self.weights = [weights[k] for k in self.kinds]
+        self.client_ids = [f"loadtest-client-{i}" for i in range(args.clients)]
+        self.sessions: Dict[str, List[str]] = defaultdict(list)
+        self.results: List[Tuple[str, float, bool]] = []
+        self._lock = threading.Lock()
+        self._issued = 0
+        self._deadline: Optional[float] = None
+
+    def _request(self, method: str, path: str, body: Optional[dict] = None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                     headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=120) as resp:
+            return resp.status, json.loads(resp.read().decode("utf-8"))
+
+    def _next_ticket(self) -> bool:
+        with self._lock:
+            if self._issued >= self.args.requests:
+                return False
+            if self._deadline and time.perf_counter() >= self._deadline:
+                return False
+            self._issued += 1
+            return True
+
+    def _one(self, rng: random.Random):
+        kind = rng.choices(self.kinds, weights=self.weights)[0]
+        client_id = rng.choice(self.client_ids)
+        with self._lock:
+            known = list(self.sessions[client_id])
+        if kind == "session" and not known:
+            kind = "sessions"
+
+        start = time.perf_counter()
+        ok = True
+        try:
+            if kind == "chat":
+                session_id = rng.choice(known) if known and rng.random() < 0.5 else None
+                status, data = self._request("POST", "/chat", {
+                    "message": rng.choice(SAMPLE_QUESTIONS),
+                    "style": rng.choice(["general", "professional", "humorous"]),
+                    "session_id": session_id,
+                    "client_id": client_id,
+                })
+                # /chat 失敗時仍回 200，以回覆內容判斷
+                ok = status == 200 and not data.get("reply", "").startswith("❌")
+                # 失敗時後端不會 commit 新對話，只記錄成功建立的 session
+                if ok and not session_id and data.get("session_id"):
+                    with self._lock:
+                        self.sessions[client_id].append(data["session_id"])
+            elif kind == "sessions":
+                status, _ = self._request("GET", f"/sessions?client_id={client_id}")
+                ok = status == 200
+            else:
+                status, _ = self._request("GET", f"/sessions/{rng.choice(known)}")
+                ok = status == 200
+        except (urllib.error.URLError, OSError, ValueError):
+            ok = False
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.results.append((kind, elapsed_ms, ok))
+
+    def run(self) -> float:
+        if self.args.duration:
+            self._deadline = time.perf_counter() + self.args.duration
+
+        def worker(worker_id: int):
+            rng = random.Random(self.args.seed + worker_id)
+            while self._next_ticket():
+                self._one(rng)
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(self.args.concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return time.perf_counter() - start
+
+
+def build_report(results: List[Tuple[str, float, bool]], elapsed: float, stages: Dict[str, List[float]], args) -> dict:
+    def summary(latencies: List[float], errors: int) -> dict:
+        return {
+            "count": len(latencies),
+            "error_rate": errors / len(latencies) if latencies else 0.0,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+        }
+
+    by_kind: Dict[str, List[Tuple[float, bool]]] = defaultdict(list)
+    for kind, ms, ok in results:
+        by_kind[kind].append((ms, ok))
+
+    report = {
+        "concurrency": args.concurrency,
+        "elapsed_s": elapsed,
+        "throughput_rps": len(results) / elapsed if elapsed else 0.0,
+        "overall": summary([ms for _, ms, _ in results], sum(1 for *_, ok in results if not ok)),
+        "endpoints": {
+            kind: summary([ms for ms, _ in rows], sum(1 for _, ok in rows if not ok))
+            for kind, rows in by_kind.items()
+        },
+        "stages": {
+            stage: {
+                "count": len(values),
+                "mean_ms": sum(values) / len(values),
+                "p50_ms": percentile(values, 50),
+                "p95_ms": percentile(values, 95),
+                "p99_ms": percentile(values, 99),
+            }
+            for stage, values in stages.items() if values
+        },
+    }
+    return report
+
+
+def print_report(report: dict):
+    print("\n📊 壓力測試結果")
+    print(f"   並行數: {report['concurrency']} | 耗時: {report['elapsed_s']:.1f}s | 吞吐量: {report['throughput_rps']:.2f} req/s")
+    header = f"   {'項目':<14}{'數量':>7}{'錯誤率':>9}{'p50':>10}{'p95':>10}{'p99':>10}"
+    print(header)
+    rows = [("overall", report["overall"])] + [(f"/{k}", v) for k, v in sorted(report["endpoints"].items())]
+    for name, s in rows:
+        print(f"   {name:<14}{s['count']:>7}{s['error_rate']:>9.1%}{s['p50_ms']:>9.0f}ms{s['p95_ms']:>8.0f}ms{s['p99_ms']:>8.0f}ms")
+
+    print("\n⏱️ 各階段耗時 (後端內部)")
+    print(f"   {'階段':<18}{'次數':>7}{'平均':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for stage, s in sorted(report["stages"].items()):
+        print(f"   {stage:<18}{s['count']:>7}{s['mean_ms']:>8.0f}ms{s['p50_ms']:>8.0f}ms{s['p95_ms']:>8.0f}ms{s['p99_ms']:>8.0f}ms")
+
+
+def main_cli():
+    args = parse_args()
+    weights = parse_mix(args.mix)
+
+    # 全部使用暫存資料，不碰正式的 chat_history.db
+    tmp_dir = tempfile.mkdtemp(prefix="legal-loadtest-")
+    os.environ["CHAT_DB_FILE"] = str(Path(tmp_dir) / "chat_history.db")
+    os.environ["CHAT_ARCHIVE_DB_FILE"] = str(Path(tmp_dir) / "chat_archive.db")
+    os.environ["CHAT_RETENTION_DAYS"] = "0"
+    os.environ.setdefault("GOOGLE_API_KEY", "fake-key-for-loadtest")
+
+    recorder = fake_gemini.StageRecorder()
+    fake_gemini.install(fake_gemini.FakeGeminiConfig(
+        rewrite_latency_ms=args.rewrite_latency_ms,
+        answer_latency_ms=args.answer_latency_ms,
+        embed_latency_ms=args.embed_latency_ms,
+        latency_sigma=args.latency_sigma,
+        rate_limit_rate=args.rate_limit_rate,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    ), recorder)
+
+    print(f"🚀 載入後端 (暫存資料夾: {tmp_dir})...")
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        backend = load_backend(recorder)
+
+    port = free_port()
+    server, thread = start_server(backend.app, port)
+    print(f"🔥 開始壓測：{args.concurrency} 並行 / {args.requests} 請求" + (f" / 最長 {args.duration}s" if args.duration else ""))
+
+    driver = TrafficDriver(f"http://127.0.0.1:{port}", args, weights)
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        elapsed = driver.run()
+
+    server.should_exit = True
+    thread.join(timeout=5)
+
+    report = build_report(driver.results, elapsed, recorder.snapshot(), args)
+    print_report(report)
+    if args.json_output:
+        with open(args.json_output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 JSON 報告已儲存：{args.json_output}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,22 +1,28 @@
 import os
 import json
 import jieba
+import numpy as np
 import sqlite3
 import uuid
 import re
 import urllib.parse
 import base64
-from datetime import datetime
+import zlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from rank_bm25 import BM25Okapi
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, field_validator
 import chromadb
 from chromadb.utils import embedding_functions
 import google.generativeai as genai
 from dotenv import load_dotenv
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Callable, Tuple
 
 # --- 1. 環境設定 ---
 base_path = Path(__file__).parent.parent
@@ -29,28 +35,170 @@ if not GOOGLE_API_KEY:
 genai.configure(api_key=GOOGLE_API_KEY)
 
 # --- 2. 初始化 SQLite 資料庫 ---
-DB_FILE = base_path / "backend" / "chat_history.db"
+# 可用環境變數指定其他路徑 (例如壓力測試用的暫存資料庫)
+DB_FILE = Path(os.getenv("CHAT_DB_FILE", base_path / "backend" / "chat_history.db"))
+ARCHIVE_DB_FILE = Path(os.getenv("CHAT_ARCHIVE_DB_FILE", base_path / "backend" / "chat_archive.db"))
+
+# 保存期限設定：超過 CHAT_RETENTION_DAYS 天沒有新訊息的對話會被壓縮搬到封存庫 (預設 0 = 不封存)
+CHAT_RETENTION_DAYS = int(os.getenv("CHAT_RETENTION_DAYS", "0"))
+CHAT_RETENTION_INTERVAL_SECONDS = int(os.getenv("CHAT_RETENTION_INTERVAL_SECONDS", "3600"))
+CHAT_RETENTION_BATCH_SIZE = int(os.getenv("CHAT_RETENTION_BATCH_SIZE", "200"))
+CHAT_VACUUM_PAGES = int(os.getenv("CHAT_VACUUM_PAGES", "1000"))
 
 def init_db():
     conn = sqlite3.connect(DB_FILE)
     c = conn.cursor()
+    # 新建的資料庫直接啟用 incremental_vacuum；舊檔案的轉換交給封存排程 (需要一次完整 VACUUM)
+    if not c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sessions'").fetchone():
+        c.execute("PRAGMA auto_vacuum = INCREMENTAL")
     c.execute('''CREATE TABLE IF NOT EXISTS sessions
                  (id TEXT PRIMARY KEY, client_id TEXT, title TEXT, created_at TIMESTAMP, last_analysis TEXT)''')
     c.execute('''CREATE TABLE IF NOT EXISTS messages
                  (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, role TEXT, content TEXT, analysis TEXT, created_at TIMESTAMP)''')
+    # 分頁用索引 (keyset pagination)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sessions_client_created ON sessions (client_id, created_at, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages (session_id, id)")
+    # 刪除對話時一併刪除訊息 (舊表沒有 FOREIGN KEY，改用 trigger 串聯刪除)
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_sessions_cascade_delete
+                 AFTER DELETE ON sessions
+                 BEGIN DELETE FROM messages WHERE session_id = OLD.id; END''')
+    conn.commit()
+    conn.close()
+
+    conn = sqlite3.connect(ARCHIVE_DB_FILE)
+    conn.execute('''CREATE TABLE IF NOT EXISTS archived_sessions
+                    (id TEXT PRIMARY KEY, client_id TEXT, title TEXT, created_at TIMESTAMP,
+                     last_activity TIMESTAMP, archived_at TIMESTAMP, message_count INTEGER, payload BLOB)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_archived_client ON archived_sessions (client_id, created_at)")
     conn.commit()
     conn.close()
 
 init_db()
 
+# --- 2.1 對話保存期限與封存 ---
+def archive_old_sessions(conn: sqlite3.Connection, cutoff: str, batch_size: int = CHAT_RETENTION_BATCH_SIZE) -> int:
+    """把最後活動時間早於 cutoff 的對話壓縮後搬到 archive.archived_sessions，回傳搬移筆數。
+    conn 必須已 ATTACH 封存庫為 archive，搬移與刪除在同一個交易內完成。"""
+    c = conn.cursor()
+    c.execute('''SELECT s.id, s.client_id, s.title, s.created_at, s.last_analysis,
+                        COALESCE(MAX(m.created_at), s.created_at) AS last_activity
+                 FROM sessions s LEFT JOIN messages m ON m.session_id = s.id
+                 GROUP BY s.id
+                 HAVING last_activity < ?
+                 LIMIT ?''', (cutoff, batch_size))
+    stale = c.fetchall()
+    archived_at = datetime.now().isoformat()
+    for session_id, client_id, title, created_at, last_analysis, last_activity in stale:
+        c.execute("SELECT id, role, content, analysis, created_at FROM messages WHERE session_id = ? ORDER BY id ASC", (session_id,))
+        messages = [
+            {"id": row[0], "role": row[1], "content": row[2], "analysis": row[3], "created_at": row[4]}
+            for row in c.fetchall()
+        ]
+        payload = zlib.compress(
+            json.dumps({"last_analysis": last_analysis, "messages": messages}, ensure_ascii=False).encode("utf-8")
+        )
+        c.execute('''INSERT OR REPLACE INTO archive.archived_sessions
+                     (id, client_id, title, created_at, last_activity, archived_at, message_count, payload)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                  (session_id, client_id, title, created_at, last_activity, archived_at, len(messages), payload))
+        # trigger 會一併刪除 messages
+        c.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+    conn.commit()
+    return len(stale)
+
+def run_retention_once() -> Dict[str, int]:
+    """執行一次封存、清除孤兒訊息，並以 incremental_vacuum 歸還空間。"""
+    cutoff = (datetime.now() - timedelta(days=CHAT_RETENTION_DAYS)).isoformat()
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        conn.execute("ATTACH DATABASE ? AS archive", (str(ARCHIVE_DB_FILE),))
+        archived = 0
+        while True:
+            moved = archive_old_sessions(conn, cutoff, CHAT_RETENTION_BATCH_SIZE)
+            archived += moved
+            if moved < CHAT_RETENTION_BATCH_SIZE:
+                break
+        orphans = conn.execute("DELETE FROM messages WHERE session_id NOT IN (SELECT id FROM sessions)").rowcount
+        conn.commit()
+        conn.execute("DETACH DATABASE archive")
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # 舊資料庫一次性轉換為 incremental 模式；被其他連線鎖住時略過，下次排程再試
+            try:
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM")
+            except sqlite3.OperationalError as e:
+                print(f"⚠️ 轉換 auto_vacuum 失敗，下次再試: {e}")
+        freed = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        conn.execute(f"PRAGMA incremental_vacuum({CHAT_VACUUM_PAGES})").fetchall()
+        freed -= conn.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        conn.close()
+    return {"archived_sessions": archived, "orphan_messages": orphans, "vacuumed_pages": freed}
+
+def load_archived_session(session_id: str) -> Optional[Dict[str, Any]]:
+    """讀取封存的對話 (含解壓後的 messages)，找不到時回傳 None。"""
+    archive = sqlite3.connect(ARCHIVE_DB_FILE)
+    try:
+        row = archive.execute(
+            "SELECT client_id, title, created_at, payload FROM archived_sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+    finally:
+        archive.close()
+    if not row:
+        return None
+
+    client_id, title, created_at, payload = row
+    data = json.loads(zlib.decompress(payload).decode("utf-8"))
+    return {"client_id": client_id, "title": title, "created_at": created_at,
+            "last_analysis": data.get("last_analysis"), "messages": data["messages"]}
+
+def restore_archived_session(conn: sqlite3.Connection, session_id: str) -> bool:
+    """把封存的對話寫回主資料庫 (不 commit，由呼叫端決定)，找不到時回傳 False。
+    commit 成功後需再呼叫 drop_archived_session 移除封存。"""
+    data = load_archived_session(session_id)
+    if not data:
+        return False
+
+    c = conn.cursor()
+    c.execute("INSERT OR IGNORE INTO sessions (id, client_id, title, created_at, last_analysis) VALUES (?, ?, ?, ?, ?)",
+              (session_id, data["client_id"], data["title"], data["created_at"], data["last_analysis"] or "{}"))
+    # AUTOINCREMENT 不會重複使用 id，可直接沿用原本的訊息 id
+    c.executemany(
+        "INSERT OR IGNORE INTO messages (id, session_id, role, content, analysis, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        [(m["id"], session_id, m["role"], m["content"], m["analysis"], m["created_at"]) for m in data["messages"]],
+    )
+    return True
+
+def drop_archived_session(session_id: str):
+    archive = sqlite3.connect(ARCHIVE_DB_FILE)
+    try:
+        archive.execute("DELETE FROM archived_sessions WHERE id = ?", (session_id,))
+        archive.commit()
+    finally:
+        archive.close()
+
+_retention_stop = threading.Event()
+
+def retention_worker():
+    while not _retention_stop.is_set():
+        try:
+            stats = run_retention_once()
+            if any(stats.values()):
+                print(f"🧹 對話封存完成: {stats}")
+        except Exception as e:
+            print(f"⚠️ 對話封存失敗: {e}")
+        _retention_stop.wait(CHAT_RETENTION_INTERVAL_SECONDS)
+
 # --- 3. 初始化 ChromaDB ---
 current_dir = Path(__file__).parent
 DB_PATH = current_dir / "chroma_db"
 client = chromadb.PersistentClient(path=str(DB_PATH))
 
+EMBEDDING_MODEL = "models/text-embedding-004"
+
 google_ef = embedding_functions.GoogleGenerativeAiEmbeddingFunction(
     api_key=GOOGLE_API_KEY,
-    model_name="models/text-embedding-004",
+    model_name=EMBEDDING_MODEL,
     task_type="retrieval_query"
 )
 
@@ -89,6 +237,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+def start_retention_worker():
+    # CHAT_RETENTION_DAYS <= 0 代表不封存
+    if CHAT_RETENTION_DAYS > 0:
+        threading.Thread(target=retention_worker, name="chat-retention", daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_retention_worker():
+    _retention_stop.set()
+
 class ChatRequest(BaseModel):
     message: str
     style: str = "general"
@@ -98,6 +256,25 @@ class ChatRequest(BaseModel):
 class CreateSessionRequest(BaseModel):
     client_id: str
 
+# Gemini batchEmbedContents 每次最多 100 筆，依此切批
+SEARCH_CHUNK_SIZE = int(os.getenv("SEARCH_CHUNK_SIZE", "100"))
+SEARCH_MAX_QUERIES = int(os.getenv("SEARCH_MAX_QUERIES", "10000"))
+
+class SearchRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=SEARCH_MAX_QUERIES)
+    top_k: int = Field(30, ge=1, le=100)
+    include_text: bool = False
+    stream: bool = False
+
+    @field_validator("queries")
+    @classmethod
+    def reject_blank_queries(cls, queries: List[str]) -> List[str]:
+        # 空白查詢會讓整批 embedding 請求失敗
+        blank = [i for i, q in enumerate(queries) if not q.strip()]
+        if blank:
+            raise ValueError(f"第 {blank[:10]} 筆查詢為空白")
+        return queries
+
 # --- 核心功能 ---
 def expand_synonyms(query: str) -> str:
     synonyms = {
@@ -144,42 +321,218 @@ def expand_synonyms(query: str) -> str:
             expanded += f" {value}"
     return expanded
 
-def hybrid_search(query: str):
-    expanded_query = expand_synonyms(query)
-    print(f"🔍 擴展後搜尋詞: {expanded_query}")
-    
-    final_docs = []
-    seen_ids = set()
-    
-    if bm25:
-        tokenized_query = list(jieba.cut(expanded_query))
-        bm25_results = bm25.get_top_n(tokenized_query, all_laws, n=50)
-        for doc in bm25_results:
-            if doc['id'] not in seen_ids:
-                final_docs.append({"text": doc['text'], "id": doc['id'], "score": 0.8})
-                seen_ids.add(doc['id'])
+def bm25_top_n(tokenized_query: List[str], n: int = 50) -> List[Tuple[Dict[str, Any], float]]:
+    """與 BM25Okapi.get_top_n 相同的排序，但一併回傳分數。"""
+    scores = bm25.get_scores(tokenized_query)
+    top = np.argsort(scores)[::-1][:n]
+    return [(all_laws[i], float(scores[i])) for i in top]
+
+def vector_hits_at(vector_results: Dict[str, Any], index: int) -> List[Tuple[str, str, Optional[float]]]:
+    """取出 collection.query 第 index 個查詢的 (id, text, distance)。"""
+    if not vector_results['documents'] or not vector_results['documents'][index]:
+        return []
+    distances = vector_results.get('distances')
+    row_distances = distances[index] if distances else [None] * len(vector_results['ids'][index])
+    return list(zip(vector_results['ids'][index], vector_results['documents'][index], row_distances))
+
+def fuse_candidates(
+    bm25_hits: List[Tuple[Dict[str, Any], float]],
+    vector_hits: List[Tuple[str, str, Optional[float]]],
+) -> Dict[str, Dict[str, Any]]:
+    """合併 BM25 與向量結果，回傳 {id: {text, id, score, legs}}，legs 記錄各路的名次與分數。
+    BM25 固定取前 50 名，不足時會補上分數為 0 的法條，legs.bm25.matched 標示是否真的命中。"""
+    docs: Dict[str, Dict[str, Any]] = {}
+    for rank, (law, score) in enumerate(bm25_hits, start=1):
+        if law['id'] not in docs:
+            docs[law['id']] = {"text": law['text'], "id": law['id'], "score": 0.8,
+                               "legs": {"bm25": {"rank": rank, "score": score, "matched": score > 0}}}
+
+    for rank, (doc_id, doc_text, distance) in enumerate(vector_hits, start=1):
+        if doc_id not in docs:
+            docs[doc_id] = {"text": doc_text, "id": doc_id, "score": 0.7, "legs": {}}
+        else:
+            docs[doc_id]['score'] += 0.5
+        docs[doc_id]["legs"].setdefault("vector", {"rank": rank, "distance": distance})
+    return docs
 
+def retrieve_candidates(expanded_query: str) -> Dict[str, Dict[str, Any]]:
+    """BM25 + 向量雙路檢索，回傳 {id: {text, id, score, legs}}，尚未做關鍵字加權。"""
+    bm25_hits = bm25_top_n(list(jieba.cut(expanded_query))) if bm25 else []
     vector_results = collection.query(query_texts=[expanded_query], n_results=50)
-    
-    if vector_results['documents'] and vector_results['documents'][0]:
-        for i, doc_text in enumerate(vector_results['documents'][0]):
-            doc_id = vector_results['ids'][0][i]
-            if doc_id not in seen_ids:
-                final_docs.append({"text": doc_text, "id": doc_id, "score": 0.7})
-                seen_ids.add(doc_id)
-            else:
-                for item in final_docs:
-                    if item['id'] == doc_id:
-                        item['score'] += 0.5
-
-    keywords = list(jieba.cut(query))
+    return fuse_candidates(bm25_hits, vector_hits_at(vector_results, 0))
+
+def score_candidates(docs: Dict[str, Dict[str, Any]], query: str, keywords: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """依原始問題關鍵字加權，回傳由高到低排序的候選法條。"""
+    final_docs = list(docs.values())
+    keywords = keywords if keywords is not None else list(jieba.cut(query))
     for item in final_docs:
-        for kw in keywords:
-            if len(kw) > 1 and kw in item['text']:
-                item['score'] += 0.3
+        hits = [kw for kw in keywords if len(kw) > 1 and kw in item['text']]
+        item['score'] += 0.3 * len(hits)
+        if hits:
+            item.setdefault("legs", {})["keyword"] = {"hits": hits}
 
     final_docs.sort(key=lambda x: x['score'], reverse=True)
-    return "\n\n".join([item['text'] for item in final_docs[:30]])
+    return final_docs
+
+def rank_candidates(docs: Dict[str, Dict[str, Any]], query: str) -> str:
+    """回傳加權排序後前 30 條法條文字。"""
+    return "\n\n".join([item['text'] for item in score_candidates(docs, query)[:30]])
+
+def hybrid_search(query: str):
+    expanded_query = expand_synonyms(query)
+    print(f"🔍 擴展後搜尋詞: {expanded_query}")
+    return rank_candidates(retrieve_candidates(expanded_query), query)
+
+# --- 批次檢索 (/search) ---
+
+def embed_queries(texts: List[str]) -> List[List[float]]:
+    """一次 embedding 請求取得多筆查詢向量。"""
+    return genai.embed_content(model=EMBEDDING_MODEL, content=texts, task_type="retrieval_query")["embedding"]
+
+def iter_batch_search(queries: List[str], top_k: int = 30, include_text: bool = False):
+    """逐批檢索 (每批一次 embedding、一次 collection.query)，依輸入順序產出每個查詢的結果。
+    某一批失敗 (例如 Gemini 429) 時，該批每個查詢改產出 {"index", "query", "error"}，其餘批次照常進行。"""
+    for start in range(0, len(queries), SEARCH_CHUNK_SIZE):
+        chunk = queries[start:start + SEARCH_CHUNK_SIZE]
+        expanded = [expand_synonyms(q) for q in chunk]
+        tokenized = [list(jieba.cut(text)) for text in expanded]
+        keywords = [list(jieba.cut(q)) for q in chunk]
+
+        try:
+            vector_results = collection.query(query_embeddings=embed_queries(expanded), n_results=50)
+        except Exception as e:
+            print(f"⚠️ 批次檢索失敗 (第 {start}~{start + len(chunk) - 1} 筆): {e}")
+            for i, query in enumerate(chunk):
+                yield {"index": start + i, "query": query, "error": str(e)}
+            continue
+
+        for i, query in enumerate(chunk):
+            bm25_hits = bm25_top_n(tokenized[i]) if bm25 else []
+            docs = fuse_candidates(bm25_hits, vector_hits_at(vector_results, i))
+            results = []
+            for item in score_candidates(docs, query, keywords[i])[:top_k]:
+                entry = {"id": item['id'], "score": round(item['score'], 4), "legs": item['legs']}
+                if include_text:
+                    entry["text"] = item['text']
+                results.append(entry)
+            yield {"index": start + i, "query": query, "expanded_query": expanded[i], "results": results}
+
+# --- 推測式檢索 (與查詢改寫並行) ---
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "1") != "0"
+# 改寫前後詞彙 Jaccard 相似度 >= REUSE 直接沿用；介於 MERGE 與 REUSE 之間只補搜新詞；低於 MERGE 重新檢索
+SPECULATIVE_REUSE_THRESHOLD = float(os.getenv("SPECULATIVE_REUSE_THRESHOLD", "0.8"))
+SPECULATIVE_MERGE_THRESHOLD = float(os.getenv("SPECULATIVE_MERGE_THRESHOLD", "0.3"))
+
+SPECULATIVE_WORKERS = int(os.getenv("SPECULATIVE_WORKERS", "4"))
+
+retrieval_executor = ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS, thread_name_prefix="speculative-retrieval")
+
+_speculation_lock = threading.Lock()
+# wasted_retrievals：被捨棄但已開始執行 (已花掉 embedding 呼叫) 的推測檢索
+# skipped：執行緒池已滿，直接走序列流程
+speculation_stats = {"total": 0, "reused": 0, "incremental": 0, "discarded": 0, "failed": 0,
+                     "wasted_retrievals": 0, "skipped": 0, "saved_ms": 0.0}
+_retrievals_inflight = 0
+
+def submit_retrieval(fn: Callable, *args):
+    """送進檢索執行緒池並追蹤尚未完成的工作數。"""
+    global _retrievals_inflight
+    with _speculation_lock:
+        _retrievals_inflight += 1
+
+    def _done(_future):
+        global _retrievals_inflight
+        with _speculation_lock:
+            _retrievals_inflight -= 1
+
+    future = retrieval_executor.submit(fn, *args)
+    future.add_done_callback(_done)
+    return future
+
+def retrieval_pool_busy() -> bool:
+    with _speculation_lock:
+        return _retrievals_inflight >= SPECULATIVE_WORKERS
+
+def query_terms(text: str) -> set:
+    return {tok for tok in jieba.cut(text) if len(tok.strip()) > 1}
+
+def timed_retrieve(expanded_query: str) -> Tuple[Dict[str, Dict[str, Any]], float]:
+    start = time.perf_counter()
+    docs = retrieve_candidates(expanded_query)
+    return docs, (time.perf_counter() - start) * 1000
+
+def merge_candidates(base: Dict[str, Dict[str, Any]], extra: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """合併兩次檢索結果，同一法條取較高分數。"""
+    merged = {doc_id: dict(item) for doc_id, item in base.items()}
+    for doc_id, item in extra.items():
+        if doc_id not in merged or item['score'] > merged[doc_id]['score']:
+            merged[doc_id] = dict(item)
+    return merged
+
+def speculative_search(user_question: str, rewrite: Callable[[], str]) -> Tuple[str, str]:
+    """改寫查詢的同時，先用原始問題 (同義詞擴展後) 進行檢索。
+    改寫完成後依相似度決定沿用、補搜新詞後合併，或捨棄推測結果重新檢索。
+    回傳 (rewritten_query, context_text)。"""
+    if retrieval_pool_busy():
+        # 佇列已塞滿時推測只會排隊，反而多花 embedding；改走序列流程
+        with _speculation_lock:
+            speculation_stats["skipped"] += 1
+        rewritten_query = rewrite()
+        return rewritten_query, hybrid_search(rewritten_query)
+
+    start = time.perf_counter()
+    raw_expanded = expand_synonyms(user_question)
+    spec_future = submit_retrieval(timed_retrieve, raw_expanded)
+
+    rewritten_query = rewrite()
+    rewrite_ms = (time.perf_counter() - start) * 1000
+
+    rewritten_expanded = expand_synonyms(rewritten_query)
+    raw_terms = query_terms(raw_expanded)
+    new_terms = query_terms(rewritten_expanded)
+    union = raw_terms | new_terms
+    similarity = len(raw_terms & new_terms) / len(union) if union else 1.0
+    added_terms = new_terms - raw_terms
+
+    mode = "reused"
+    if similarity < SPECULATIVE_MERGE_THRESHOLD:
+        mode = "discarded"
+    elif similarity < SPECULATIVE_REUSE_THRESHOLD and added_terms:
+        mode = "incremental"
+
+    wasted = False
+    if mode == "discarded":
+        # 尚未開始執行才能真正取消；已在執行中的推測檢索會在背景跑完後丟棄，計入 wasted_retrievals
+        wasted = not spec_future.cancel()
+        candidates, retrieval_ms = timed_retrieve(rewritten_expanded)
+    else:
+        incremental_future = None
+        if mode == "incremental":
+            incremental_future = submit_retrieval(retrieve_candidates, " ".join(sorted(added_terms)))
+        try:
+            candidates, retrieval_ms = spec_future.result()
+            if incremental_future:
+                candidates = merge_candidates(candidates, incremental_future.result())
+        except Exception as e:
+            print(f"⚠️ 推測檢索失敗，改用改寫後查詢: {e}")
+            if incremental_future:
+                incremental_future.cancel()
+            mode = "failed"
+            candidates, retrieval_ms = timed_retrieve(rewritten_expanded)
+
+    context_text = rank_candidates(candidates, rewritten_query)
+    actual_ms = (time.perf_counter() - start) * 1000
+    # 序列執行的估計耗時 = 改寫 + 一次完整檢索
+    saved_ms = rewrite_ms + retrieval_ms - actual_ms
+
+    with _speculation_lock:
+        speculation_stats["total"] += 1
+        speculation_stats[mode] += 1
+        speculation_stats["wasted_retrievals"] += wasted
+        speculation_stats["saved_ms"] += saved_ms
+
+    print(f"🔍 推測檢索: {mode} | 相似度 {similarity:.2f} | 新詞 {sorted(added_terms)} | 節省 {saved_ms:.0f}ms")
+    return rewritten_query, context_text
 
 def query_gemini_rag(
     user_question: str,
@@ -197,13 +550,18 @@ def query_gemini_rag(
     history_text = "\n".join(history_lines) if history_lines else "（無可參考的歷史訊息）"
 
     rewrite_model = genai.GenerativeModel('gemini-2.5-flash')
-    try:
-        rewrite_prompt = f"請參考歷史，將使用者問題改寫為精準法律搜尋字串。歷史:{history_text} 問題:{user_question} 只輸出字串。"
-        rewritten_query = rewrite_model.generate_content(rewrite_prompt).text.strip()
-    except:
-        rewritten_query = user_question
+    def rewrite() -> str:
+        try:
+            rewrite_prompt = f"請參考歷史，將使用者問題改寫為精準法律搜尋字串。歷史:{history_text} 問題:{user_question} 只輸出字串。"
+            return rewrite_model.generate_content(rewrite_prompt).text.strip()
+        except:
+            return user_question
 
-    context_text = hybrid_search(rewritten_query)
+    if SPECULATIVE_RETRIEVAL:
+        rewritten_query, context_text = speculative_search(user_question, rewrite)
+    else:
+        rewritten_query = rewrite()
+        context_text = hybrid_search(rewritten_query)
     if not context_text: context_text = "（資料庫中未找到直接相關法條）"
     
     system_role = "你是一位台灣法律 AI 顧問。你的職責是僅回答與【台灣法律】相關的問題。如果使用者的問題完全與法律無關（例如：早餐吃什麼、旅遊推薦、心情閒聊），請禮貌拒絕回答，並引導使用者詢問法律相關問題。"
@@ -349,14 +707,87 @@ def query_gemini_rag(
 @app.get("/")
 def read_root(): return {"message": "Legal AI Backend Running"}
 
+def encode_session_cursor(created_at: str, session_id: str) -> str:
+    raw = json.dumps([created_at, session_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_session_cursor(cursor: str):
+    try:
+        created_at, session_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(created_at), str(session_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="無效的 cursor")
+
+def stream_search_results(results, total: int):
+    """NDJSON：每行一個查詢的結果，最後一行是 {"done": true, ...} 狀態列。
+    串流開始後已無法改 HTTP 狀態碼，使用者端沒收到 done 列即代表中途斷線。"""
+    done, failed = 0, 0
+    try:
+        for item in results:
+            done += 1
+            failed += "error" in item
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+    except Exception as e:
+        print(f"⚠️ 批次檢索串流中斷: {e}")
+        yield json.dumps({"done": False, "total": total, "completed": done, "failed": failed, "error": str(e)}, ensure_ascii=False) + "\n"
+        return
+    yield json.dumps({"done": True, "total": total, "completed": done, "failed": failed}, ensure_ascii=False) + "\n"
+
+@app.post("/search")
+def search(request: SearchRequest):
+    results = iter_batch_search(request.queries, request.top_k, request.include_text)
+    if request.stream:
+        return StreamingResponse(stream_search_results(results, len(request.queries)), media_type="application/x-ndjson")
+    items = list(results)
+    failed = sum(1 for item in items if "error" in item)
+    return {"results": items, "total": len(items), "failed": failed}
+
+@app.get("/stats/speculation")
+def get_speculation_stats():
+    with _speculation_lock:
+        stats = dict(speculation_stats)
+    total = stats["total"]
+    stats["reuse_rate"] = (stats["reused"] + stats["incremental"]) / total if total else 0.0
+    stats["avg_saved_ms"] = stats["saved_ms"] / total if total else 0.0
+    # 相較序列流程多花的 embedding 呼叫：捨棄但已執行的推測 + 補搜新詞
+    stats["extra_embedding_calls"] = stats["wasted_retrievals"] + stats["incremental"]
+    return stats
+
 @app.get("/sessions")
-def get_sessions(client_id: str = Query(..., description="使用者的唯一 ID")):
+def get_sessions(
+    client_id: str = Query(..., description="使用者的唯一 ID"),
+    limit: int = Query(30, ge=1, le=100, description="每頁筆數"),
+    cursor: Optional[str] = Query(None, description="上一頁回傳的 next_cursor"),
+):
     conn = sqlite3.connect(DB_FILE)
+    conn.execute("ATTACH DATABASE ? AS archive", (str(ARCHIVE_DB_FILE),))
     c = conn.cursor()
-    c.execute("SELECT id, title, created_at FROM sessions WHERE client_id = ? ORDER BY created_at DESC", (client_id,))
-    sessions = [{"id": row[0], "title": row[1], "created_at": row[2]} for row in c.fetchall()]
+    # 已封存的對話仍列在側欄，開啟時由 /sessions/{id} 讀封存、/chat 還原
+    all_sessions = """(SELECT id, title, created_at, client_id FROM sessions
+                       UNION SELECT id, title, created_at, client_id FROM archive.archived_sessions)"""
+    if cursor:
+        created_at, last_id = decode_session_cursor(cursor)
+        c.execute(
+            f"""SELECT id, title, created_at FROM {all_sessions}
+               WHERE client_id = ? AND (created_at < ? OR (created_at = ? AND id < ?))
+               ORDER BY created_at DESC, id DESC LIMIT ?""",
+            (client_id, created_at, created_at, last_id, limit + 1),
+        )
+    else:
+        c.execute(
+            f"SELECT id, title, created_at FROM {all_sessions} WHERE client_id = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+            (client_id, limit + 1),
+        )
+    rows = c.fetchall()
     conn.close()
-    return sessions
+
+    # 多拿一筆判斷是否還有下一頁
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_session_cursor(rows[-1][2], rows[-1][0])
+    sessions = [{"id": row[0], "title": row[1], "created_at": row[2]} for row in rows]
+    return {"sessions": sessions, "next_cursor": next_cursor}
 
 @app.post("/sessions")
 def create_session(request: CreateSessionRequest):
@@ -374,45 +805,87 @@ def create_session(request: CreateSessionRequest):
 def delete_session(session_id: str):
     conn = sqlite3.connect(DB_FILE)
     c = conn.cursor()
+    # messages 由 trg_sessions_cascade_delete 串聯刪除
     c.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
-    c.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
     conn.commit()
     conn.close()
+    drop_archived_session(session_id)
     return {"status": "deleted", "id": session_id}
 
 @app.get("/sessions/{session_id}")
-def get_session_messages(session_id: str):
+def get_session_messages(
+    session_id: str,
+    limit: int = Query(50, ge=1, le=200, description="每頁訊息數"),
+    before: Optional[int] = Query(None, description="只取 id 小於此值的較舊訊息 (上一頁的 next_cursor)"),
+):
     conn = sqlite3.connect(DB_FILE)
     c = conn.cursor()
-    c.execute("SELECT role, content, analysis FROM messages WHERE session_id = ? ORDER BY id ASC", (session_id,))
+    c.execute("SELECT last_analysis FROM sessions WHERE id = ?", (session_id,))
+    session_row = c.fetchone()
+    if session_row:
+        last_analysis = session_row[0]
+        if before is not None:
+            c.execute(
+                "SELECT id, role, content, analysis FROM messages WHERE session_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (session_id, before, limit + 1),
+            )
+        else:
+            c.execute(
+                "SELECT id, role, content, analysis FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, limit + 1),
+            )
+        rows = c.fetchall()
+    else:
+        # 已封存的對話直接從封存庫讀取，不必還原
+        archived = load_archived_session(session_id)
+        last_analysis = archived["last_analysis"] if archived else None
+        archived_rows = [
+            (m["id"], m["role"], m["content"], m["analysis"])
+            for m in (archived["messages"] if archived else [])
+            if before is None or m["id"] < before
+        ]
+        rows = sorted(archived_rows, key=lambda r: r[0], reverse=True)[:limit + 1]
+    conn.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1][0]
+
+    # 由新到舊查詢，回傳時轉回時間順序
     messages = []
-    for row in c.fetchall():
-        msg = {"role": row[0], "content": row[1]}
-        if row[2]:
+    for row in reversed(rows):
+        msg = {"id": row[0], "role": row[1], "content": row[2]}
+        if row[3]:
             try:
-                msg["analysis"] = json.loads(row[2])
+                msg["analysis"] = json.loads(row[3])
             except:
                 pass
         messages.append(msg)
     
-    c.execute("SELECT last_analysis FROM sessions WHERE id = ?", (session_id,))
-    row = c.fetchone()
-    analysis = json.loads(row[0]) if row and row[0] else None
-    conn.close()
-    return {"messages": messages, "analysis": analysis}
+    analysis = json.loads(last_analysis) if last_analysis else None
+    return {"messages": messages, "analysis": analysis, "next_cursor": next_cursor}
 
 @app.post("/chat")
 async def chat(request: ChatRequest):
     session_id = request.session_id
+    is_new_session = not session_id
     conn = sqlite3.connect(DB_FILE)
     c = conn.cursor()
     
-    if not session_id:
+    if is_new_session:
         session_id = str(uuid.uuid4())
         created_at = datetime.now().isoformat()
         title = request.message[:10]
         c.execute("INSERT INTO sessions (id, client_id, title, created_at, last_analysis) VALUES (?, ?, ?, ?, ?)", 
                   (session_id, request.client_id, title, created_at, "{}"))
+    elif not c.execute("SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone():
+        # 側欄可能還留著已被封存的對話：先從封存庫還原，已刪除的則回 404
+        if not restore_archived_session(conn, session_id):
+            conn.close()
+            raise HTTPException(status_code=404, detail="找不到此對話")
+        conn.commit()
+        drop_archived_session(session_id)
     
     c.execute(
         "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT 10",
@@ -431,17 +904,26 @@ async def chat(request: ChatRequest):
         c.execute("INSERT INTO messages (session_id, role, content, analysis, created_at) VALUES (?, ?, ?, ?, ?)", (session_id, "user", request.message, None, now))
         c.execute("INSERT INTO messages (session_id, role, content, analysis, created_at) VALUES (?, ?, ?, ?, ?)", (session_id, "assistant", ai_reply, json.dumps(analysis_data), now))
         
-        c.execute("UPDATE sessions SET last_analysis = ? WHERE id = ?", (json.dumps(analysis_data), session_id))
+        restored = False
+        if c.execute("UPDATE sessions SET last_analysis = ? WHERE id = ?", (json.dumps(analysis_data), session_id)).rowcount == 0:
+            # 生成回答期間對話剛好被封存：還原後在同一個交易內寫入，避免訊息變成孤兒被清掉
+            if not restore_archived_session(conn, session_id):
+                raise RuntimeError(f"session {session_id} 已不存在")
+            c.execute("UPDATE sessions SET last_analysis = ? WHERE id = ?", (json.dumps(analysis_data), session_id))
+            restored = True
         
         conn.commit()
+        if restored:
+            drop_archived_session(session_id)
         
         return {"reply": ai_reply, "session_id": session_id, "analysis": analysis_data}
         
     except Exception as e:
         print(f"Error: {e}")
+        # 新對話的 INSERT 會隨連線關閉而 rollback，不回傳不存在的 session_id
         return {
             "reply": "❌ 系統發生錯誤，請稍後再試。",
-            "session_id": session_id,
+            "session_id": None if is_new_session else session_id,
             "analysis": None
         }
     finally:
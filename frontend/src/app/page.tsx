@@ -186,6 +186,7 @@ interface AnalysisData {
 }
 
 interface ChatMessage {
+  id?: number;
   role: "user" | "assistant";
   content: string;
   analysis?: AnalysisData;
@@ -223,6 +224,9 @@ export default function Home() {
 
   const [sessionId, setSessionId] = useState<string | null>(null);
   const [sessions, setSessions] = useState<{id: string, title: string}[]>([]);
+  const [sessionsCursor, setSessionsCursor] = useState<string | null>(null);
+  const [messagesCursor, setMessagesCursor] = useState<number | null>(null);
+  const [isLoadingOlder, setIsLoadingOlder] = useState(false);
   const [clientId, setClientId] = useState<string>("");
   
   const [isSidebarOpen, setIsSidebarOpen] = useState(false);
@@ -231,6 +235,21 @@ export default function Home() {
   const [mounted, setMounted] = useState(false);
 
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  const messagesContainerRef = useRef<HTMLDivElement>(null);
+  const skipAutoScrollRef = useRef(false);
+  // 捲動事件在下一次 render 前可能連發，載入狀態與目前對話改用 ref 同步判斷
+  const sessionIdRef = useRef<string | null>(null);
+  const loadingOlderRef = useRef(false);
+  const loadingSessionsRef = useRef(false);
+  const sessionsRequestRef = useRef(0);
+  // 已送出過的 cursor，避免 state 尚未更新時用同一個 cursor 重複載入
+  const requestedSessionsCursorRef = useRef<string | null>(null);
+  const requestedMessagesCursorRef = useRef<number | null>(null);
+
+  const selectSession = (id: string | null) => {
+    sessionIdRef.current = id;
+    setSessionId(id);
+  };
 
   useEffect(() => {
     setMounted(true);
@@ -256,6 +275,8 @@ export default function Home() {
   };
 
   useEffect(() => {
+    // 往上載入較舊訊息時保留原本捲動位置
+    if (skipAutoScrollRef.current) { skipAutoScrollRef.current = false; return; }
     scrollToBottom();
   }, [messages, isLoading]);
 
@@ -372,29 +393,81 @@ export default function Home() {
     }, 400); 
   };
 
-  const fetchSessions = async (cid: string) => {
+  const fetchSessions = async (cid: string, cursor: string | null = null) => {
     if (!cid) return;
+    if (cursor && (loadingSessionsRef.current || requestedSessionsCursorRef.current === cursor)) return;
+    requestedSessionsCursorRef.current = cursor;
+    // 重新整理第一頁時，讓還在路上的舊請求失效
+    const requestId = ++sessionsRequestRef.current;
     try {
-      const res = await fetch(`${API_URL}/sessions?client_id=${cid}`);
-      if (res.ok) {
+      loadingSessionsRef.current = true;
+      const query = cursor ? `&cursor=${encodeURIComponent(cursor)}` : "";
+      const res = await fetch(`${API_URL}/sessions?client_id=${cid}${query}`);
+      if (!res.ok) { requestedSessionsCursorRef.current = null; return; }
+      if (requestId === sessionsRequestRef.current) {
         const data = await res.json();
-        setSessions(data);
+        setSessions(prev => cursor ? [...prev, ...data.sessions] : data.sessions);
+        setSessionsCursor(data.next_cursor);
       }
-    } catch (e) { console.error("Failed to fetch sessions", e); }
+    } catch (e) { requestedSessionsCursorRef.current = null; console.error("Failed to fetch sessions", e); }
+    finally {
+      if (requestId === sessionsRequestRef.current) loadingSessionsRef.current = false;
+    }
+  };
+
+  const handleSessionsScroll = (e: React.UIEvent<HTMLDivElement>) => {
+    const el = e.currentTarget;
+    if (sessionsCursor && !loadingSessionsRef.current && el.scrollHeight - el.scrollTop - el.clientHeight < 80) {
+      fetchSessions(clientId, sessionsCursor);
+    }
   };
 
   const loadSession = async (id: string) => {
     try {
-      setIsLoading(true); setSessionId(id); setCurrentView("chat");
+      setIsLoading(true); selectSession(id); setMessagesCursor(null); setCurrentView("chat");
+      requestedMessagesCursorRef.current = null;
       const res = await fetch(`${API_URL}/sessions/${id}`);
-      if (res.ok) {
+      if (res.ok && sessionIdRef.current === id) {
         const data = await res.json();
+        if (sessionIdRef.current !== id) return;
         setMessages(data.messages);
+        setMessagesCursor(data.next_cursor);
       }
       setIsSidebarOpen(false);
     } finally { setIsLoading(false); }
   };
 
+  const loadOlderMessages = async () => {
+    const el = messagesContainerRef.current;
+    const requestedId = sessionIdRef.current;
+    if (!requestedId || messagesCursor === null || loadingOlderRef.current || !el) return;
+    if (requestedMessagesCursorRef.current === messagesCursor) return;
+    requestedMessagesCursorRef.current = messagesCursor;
+    try {
+      loadingOlderRef.current = true; setIsLoadingOlder(true);
+      const res = await fetch(`${API_URL}/sessions/${requestedId}?before=${messagesCursor}`);
+      if (!res.ok) { requestedMessagesCursorRef.current = null; return; }
+      // 請求期間已切換到其他對話則丟棄結果
+      if (sessionIdRef.current === requestedId) {
+        const data = await res.json();
+        if (sessionIdRef.current !== requestedId) return;
+        const prevHeight = el.scrollHeight;
+        const prevTop = el.scrollTop;
+        skipAutoScrollRef.current = true;
+        flushSync(() => {
+          setMessages(prev => [...data.messages, ...prev]);
+          setMessagesCursor(data.next_cursor);
+        });
+        el.scrollTop = el.scrollHeight - prevHeight + prevTop;
+      }
+    } catch (e) { requestedMessagesCursorRef.current = null; console.error("Failed to load older messages", e); }
+    finally { loadingOlderRef.current = false; setIsLoadingOlder(false); }
+  };
+
+  const handleMessagesScroll = (e: React.UIEvent<HTMLDivElement>) => {
+    if (e.currentTarget.scrollTop < 80) void loadOlderMessages();
+  };
+
   const deleteSession = async (e: React.MouseEvent, id: string) => {
       e.stopPropagation(); if(!confirm("確定刪除？")) return;
       try {
@@ -405,7 +478,7 @@ export default function Home() {
   };
 
   const startNewChat = () => {
-    setSessionId(null); setMessages([]); setCurrentView("chat");
+    selectSession(null); setMessages([]); setMessagesCursor(null); setCurrentView("chat");
     setIsSidebarOpen(false);
   };
 
@@ -426,6 +499,13 @@ export default function Home() {
         method: "POST", headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ message: trimmed, style: chatStyle, session_id: sessionId, client_id: clientId }),
       });
+      if (res.status === 404) {
+        // 對話已在其他地方被刪除
+        setSessions(prev => prev.filter(s => s.id !== sessionId));
+        selectSession(null); setMessagesCursor(null);
+        setMessages((prev) => [...prev, { role: "assistant", content: "⚠️ 這個對話已不存在，請重新發問以開啟新對話。" }]);
+        return;
+      }
       if (!res.ok) throw new Error(`HTTP ${res.status}`);
       const data = await res.json();
       
@@ -435,7 +515,7 @@ export default function Home() {
           analysis: data.analysis
       }]);
 
-      if (!sessionId && data.session_id) { setSessionId(data.session_id); fetchSessions(clientId); }
+      if (!sessionId && data.session_id) { selectSession(data.session_id); fetchSessions(clientId); }
     } catch {
       setMessages((prev) => [ ...prev, { role: "assistant", content: "❌ 後端連線失敗，請確認伺服器是否運行中。" }, ]);
     } finally { setIsLoading(false); }
@@ -588,15 +668,18 @@ export default function Home() {
         const currentModeLabel = modeInfo[chatStyle].shortLabel;
         return (
           <div className="flex flex-1 flex-col relative h-full">
-            <div className="flex-1 overflow-y-auto px-4 py-4 md:px-6 md:py-6 scrollbar-thin scrollbar-thumb-slate-300 dark:scrollbar-thumb-slate-700 space-y-4">
+            <div ref={messagesContainerRef} onScroll={handleMessagesScroll} className="flex-1 overflow-y-auto px-4 py-4 md:px-6 md:py-6 scrollbar-thin scrollbar-thumb-slate-300 dark:scrollbar-thumb-slate-700 space-y-4">
                 {messages.length === 0 ? (
                   <div className="flex h-full flex-col items-center justify-center text-slate-400 dark:text-slate-500 opacity-60">
                     <Bot className="h-16 w-16 mb-4 text-indigo-200 dark:text-indigo-900/40" /><p className="text-lg font-medium">還沒有對話紀錄</p><p className="text-sm">試著問問看「闖紅燈罰多少？」</p>
                   </div>
                 ) : (
                   <>
+                    {isLoadingOlder && (
+                        <div className="flex justify-center"><Hourglass className="h-4 w-4 text-indigo-400 animate-spin duration-[2000ms]" /></div>
+                    )}
                     {messages.map((msg, index) => (
-                        <div key={index} className="flex flex-col gap-2">
+                        <div key={msg.id ?? `local-${index}`} className="flex flex-col gap-2">
                             <div className={`flex w-full ${msg.role === "user" ? "justify-end" : "justify-start"}`}>
                                 <div className={`relative w-fit min-w-0 max-w-[95%] md:max-w-[85%] rounded-2xl px-4 py-3 shadow-sm ${fontSizeConfig[fontSize]} ${msg.role === "user" ? "bg-indigo-600 text-white ml-auto" : "bg-white dark:bg-slate-800/90 text-slate-800 dark:text-slate-200 border border-slate-200 dark:border-white/5 mr-auto"} overflow-hidden break-words`}>
                                     {msg.role === "user" ? <div className="whitespace-pre-wrap break-words">{msg.content}</div> : <ReactMarkdown urlTransform={(url) => url} components={markdownComponents}>{msg.content}</ReactMarkdown>}
@@ -693,7 +776,7 @@ export default function Home() {
             
             <button onClick={startNewChat} className="mb-4 w-full flex items-center justify-center gap-2 rounded-xl bg-indigo-600 py-3 text-sm font-bold text-white shadow-md transition hover:bg-indigo-500 active:scale-95"><Plus className="h-5 w-5" /> 開啟新對話</button>
 
-            <div className="flex-1 overflow-y-auto space-y-1 mb-4 pr-1 min-h-[150px] scrollbar-thin scrollbar-thumb-slate-200 dark:scrollbar-thumb-slate-800">
+            <div onScroll={handleSessionsScroll} className="flex-1 overflow-y-auto space-y-1 mb-4 pr-1 min-h-[150px] scrollbar-thin scrollbar-thumb-slate-200 dark:scrollbar-thumb-slate-800">
                 <p className="px-2 text-xs font-semibold text-slate-400 mb-1">歷史紀錄</p>
                 {sessions.length === 0 ? <p className="px-2 text-sm text-slate-500 italic">尚無對話</p> : sessions.map((session) => (
                     <div key={session.id} className={`group flex items-center gap-2 rounded-lg px-3 py-2 transition ${sessionId === session.id ? "bg-indigo-100 dark:bg-indigo-500/30" : "hover:bg-slate-100 dark:hover:bg-white/5"}`}>